@@ -0,0 +1,220 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+_bench_inner.pyx - compiled inner loop for bench.py's blocking worker
+
+Encodes, sends and receives mixed GET/SET/DEL commands directly on a
+connected socket fd with no Python objects on the per-op path.
+POSIX only. Build in place with:
+
+    cythonize -i _bench_inner.pyx
+
+bench.py uses run_loop() when the extension imports and falls back to
+its pure-Python loop otherwise.
+"""
+
+from libc.stdint cimport uint8_t, uint32_t, uint64_t
+from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
+from libc.stdio cimport snprintf
+from libc.errno cimport errno, EINTR
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+
+cdef extern from "<sys/socket.h>" nogil:
+    ssize_t send(int fd, const void *buf, size_t n, int flags)
+    ssize_t recv(int fd, void *buf, size_t n, int flags)
+    int MSG_NOSIGNAL
+
+cdef enum:
+    KEY_MAX = 24        # room for "k" + any int
+    SCRATCH = 65536     # discard buffer for reply payloads
+    HIST_SUB_BITS = 11  # histogram layout, must match bench.py
+    HIST_MAX_BITS = 36
+    BURST_BYTES = 16384  # request bytes per send, bench.BURST_BYTES
+
+
+cdef inline uint64_t now_ns() noexcept nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return <uint64_t>ts.tv_sec * 1000000000ULL + <uint64_t>ts.tv_nsec
+
+
+cdef inline uint64_t next_rand(uint64_t *state) noexcept nogil:
+    # xorshift64*
+    cdef uint64_t x = state[0]
+    x ^= x >> 12
+    x ^= x << 25
+    x ^= x >> 27
+    state[0] = x
+    return x * 2685821657736338717ULL
+
+
+cdef inline size_t hist_index(uint64_t v) noexcept nogil:
+    """Bucket of v in bench.LatencyHistogram's log-linear layout."""
+    cdef int shift = 0
+    cdef uint64_t x
+    if v < (1ULL << HIST_SUB_BITS):
+        return <size_t>v
+    if v >= (1ULL << HIST_MAX_BITS):
+        v = (1ULL << HIST_MAX_BITS) - 1
+    x = v >> HIST_SUB_BITS
+    while x:
+        shift += 1
+        x >>= 1
+    return (<size_t>shift << (HIST_SUB_BITS - 1)) + <size_t>(v >> shift)
+
+
+cdef inline void put_u32(uint8_t *p, uint32_t v) noexcept nogil:
+    p[0] = v & 0xff
+    p[1] = (v >> 8) & 0xff
+    p[2] = (v >> 16) & 0xff
+    p[3] = (v >> 24) & 0xff
+
+
+cdef inline uint32_t get_u32(const uint8_t *p) noexcept nogil:
+    return p[0] | (<uint32_t>p[1] << 8) | (<uint32_t>p[2] << 16) | (<uint32_t>p[3] << 24)
+
+
+cdef inline size_t put_str(uint8_t *p, const char *s, uint32_t n) noexcept nogil:
+    put_u32(p, n)
+    memcpy(p + 4, s, n)
+    return 4 + n
+
+
+cdef size_t build_packet(uint8_t *p, const char *op, int key_idx,
+                         const char *value, uint32_t value_len) noexcept nogil:
+    """Same wire format as bench.pack_command; value == NULL for GET/DEL."""
+    cdef char key[KEY_MAX]
+    cdef int klen = snprintf(key, KEY_MAX, "k%d", key_idx)
+    cdef size_t off = 8
+    put_u32(p + 4, 3 if value != NULL else 2)
+    off += put_str(p + off, op, 3)
+    off += put_str(p + off, key, <uint32_t>klen)
+    if value != NULL:
+        off += put_str(p + off, value, value_len)
+    put_u32(p, <uint32_t>(off - 4))
+    return off
+
+
+cdef int send_all(int fd, const uint8_t *p, size_t n) noexcept nogil:
+    cdef ssize_t r
+    while n > 0:
+        r = send(fd, p, n, MSG_NOSIGNAL)
+        if r < 0 and errno == EINTR:
+            continue
+        if r <= 0:
+            return -1
+        p += r
+        n -= <size_t>r
+    return 0
+
+
+cdef int recv_all(int fd, uint8_t *p, size_t n) noexcept nogil:
+    cdef ssize_t r
+    while n > 0:
+        r = recv(fd, p, n, 0)
+        if r < 0 and errno == EINTR:
+            continue
+        if r <= 0:
+            return -1
+        p += r
+        n -= <size_t>r
+    return 0
+
+
+cdef int recv_reply(int fd, uint8_t *scratch) noexcept nogil:
+    """Read one length-prefixed response and discard the payload."""
+    cdef uint32_t length
+    cdef size_t chunk
+    if recv_all(fd, scratch, 4) < 0:
+        return -1
+    length = get_u32(scratch)
+    while length > 0:
+        chunk = length if length < SCRATCH else SCRATCH
+        if recv_all(fd, scratch, chunk) < 0:
+            return -1
+        length -= <uint32_t>chunk
+    return 0
+
+
+def run_loop(int fd, long long n_ops, uint64_t seed, int keyspace,
+             double p_get, double p_set, bytes value, int pipeline,
+             unsigned long long[::1] hist_counts):
+    """
+    Run n_ops ops on the blocking socket `fd`, `pipeline` per batch
+    (cut short at BURST_BYTES so neither side blocks on a full buffer).
+
+    Latencies (us, batch send -> own reply) are counted into hist_counts
+    (a LatencyHistogram.counts array) unless it is None. Returns
+    (ops completed, latency sum, latency max); fewer than n_ops completed
+    means the connection failed.
+    """
+    cdef const char *v = value
+    cdef uint32_t vlen = <uint32_t>len(value)
+    cdef size_t max_pkt = 8 + (4 + 3) + (4 + KEY_MAX) + (4 + vlen)
+    cdef bint record = hist_counts is not None
+    cdef uint64_t lat, lat_total = 0, lat_max = 0
+    cdef uint64_t state = seed | 1
+    cdef long long done = 0
+    cdef long long batch, i
+    cdef size_t off, buf_len
+    cdef double r
+    cdef int key_idx
+    cdef uint64_t t0, t1
+    cdef bint failed = False
+    cdef uint8_t *buf
+    cdef uint8_t *scratch
+
+    if pipeline < 1:
+        pipeline = 1
+    # a batch overshoots BURST_BYTES by at most one packet
+    buf_len = max_pkt * <size_t>pipeline
+    if buf_len > BURST_BYTES + max_pkt:
+        buf_len = BURST_BYTES + max_pkt
+    buf = <uint8_t *>malloc(buf_len)
+    scratch = <uint8_t *>malloc(SCRATCH)
+    if buf == NULL or scratch == NULL:
+        free(buf)
+        free(scratch)
+        raise MemoryError()
+
+    with nogil:
+        while done < n_ops:
+            batch = n_ops - done
+            if batch > pipeline:
+                batch = pipeline
+
+            off = 0
+            i = 0
+            while i < batch and off < BURST_BYTES:
+                r = (next_rand(&state) >> 11) * (1.0 / 9007199254740992.0)
+                key_idx = <int>(next_rand(&state) % <uint64_t>keyspace)
+                if r < p_get:
+                    off += build_packet(buf + off, "get", key_idx, NULL, 0)
+                elif r - p_get < p_set:
+                    off += build_packet(buf + off, "set", key_idx, v, vlen)
+                else:
+                    off += build_packet(buf + off, "del", key_idx, NULL, 0)
+                i += 1
+            batch = i
+
+            t0 = now_ns()
+            if send_all(fd, buf, off) < 0:
+                break
+            for i in range(batch):
+                if recv_reply(fd, scratch) < 0:
+                    failed = True
+                    break
+                t1 = now_ns()
+                if record:
+                    lat = (t1 - t0) // 1000
+                    hist_counts[hist_index(lat)] += 1
+                    lat_total += lat
+                    if lat > lat_max:
+                        lat_max = lat
+                done += 1
+            if failed:
+                break
+
+    free(buf)
+    free(scratch)
+    return done, lat_total, lat_max
@@ -2,7 +2,7 @@
 """
 bench.py - benchmark custom Redis-like server
 
-Measures latency + throughput across multiple threads issuing
+Measures latency + throughput across multiple worker processes issuing
 mixed GET/SET/DEL commands over persistent TCP connections
 using the server's binary protocol:
 
@@ -14,41 +14,152 @@ Responses ignored except to read complete frame; optional decode off for speed.
 """
 
 import argparse
+import array
+import asyncio
+import bisect
+import itertools
+import math
+import multiprocessing
+import operator
+import queue
 import socket
 import struct
-import threading
 import time
 import random
 import statistics
-from typing import List, Tuple
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+# Optional compiled inner loop (build with: cythonize -i _bench_inner.pyx)
+try:
+    from _bench_inner import run_loop
+    HAVE_INNER = True
+except ImportError:
+    HAVE_INNER = False
 
 # ---- protocol encode helpers ------------------------------------------------
 
 def pack_command(parts: List[str]) -> bytes:
-    body = struct.pack("<I", len(parts))
+    chunks = [b"", struct.pack("<I", len(parts))]  # [0] = total_len slot
+    size = 4
     for p in parts:
         b = p.encode()
-        body += struct.pack("<I", len(b)) + b
-    return struct.pack("<I", len(body)) + body
+        chunks.append(struct.pack("<I", len(b)))
+        chunks.append(b)
+        size += 4 + len(b)
+    chunks[0] = struct.pack("<I", size)
+    return b"".join(chunks)
+
+
+def build_packet_tables(keyspace: int, v_payload: str) -> Tuple[List[bytes], ...]:
+    """Pre-encode the packet for every (op, key): [0=get, 1=set, 2=del][key_idx]."""
+    keys = [f"k{i}" for i in range(keyspace)]
+    return (
+        [pack_command(["get", k]) for k in keys],
+        [pack_command(["set", k, v_payload]) for k in keys],
+        [pack_command(["del", k]) for k in keys],
+    )
+
+
+# Pipelined batches of packets carrying values at least this long are
+# gather-written with sendmsg() instead of being joined into one buffer;
+# below it the iovec setup costs more than the memcpy.
+GATHER_MIN = 64
+IOV_MAX = 1024  # Linux UIO_MAXIOV
+HAVE_SENDMSG = hasattr(socket.socket, "sendmsg")
+RX_BUF = 64 * 1024  # per-worker receive scratch size
+
+# Most request bytes written before their replies are read. The server stops
+# reading a connection while it has replies queued, so writing more than the
+# socket buffers hold before reading deadlocks both sides. Small bursts also
+# keep the server's front-erase of its input buffer (quadratic per burst)
+# cheap: 16 KiB was ~10x faster than 64 KiB for 100k SETs on loopback.
+# _bench_inner uses the same limit.
+BURST_BYTES = 16 * 1024
+
+
+def send_iov(sock: socket.socket, iov: List[bytes]) -> None:
+    """sendmsg() the buffers; finish any short write with sendall()."""
+    sent = sock.sendmsg(iov)
+    if sent < sum(map(len, iov)):
+        sock.sendall(b"".join(iov)[sent:])
+
+
+def split_bursts(pkts: List[bytes], max_pkts: int,
+                 burst_bytes: int = BURST_BYTES) -> Iterator[List[bytes]]:
+    """
+    Consecutive slices of pkts, each of at most max_pkts packets and cut
+    once it holds burst_bytes (a slice always has at least one packet).
+    """
+    i, n = 0, len(pkts)
+    while i < n:
+        stop = min(n, i + max_pkts)
+        j, size = i, 0
+        while j < stop and size < burst_bytes:
+            size += len(pkts[j])
+            j += 1
+        yield pkts[i:j]
+        i = j
+
 
+def send_packets(sock: socket.socket, pkts: List[bytes], gather: bool) -> None:
+    """Write a batch of encoded packets, gather-writing when `gather` is set."""
+    if gather and len(pkts) <= IOV_MAX:
+        send_iov(sock, pkts)
+    else:
+        sock.sendall(b"".join(pkts))
 
-def send_and_wait(sock: socket.socket, parts: List[str]) -> None:
-    """Send one command; read and discard response payload."""
-    pkt = pack_command(parts)
-    sock.sendall(pkt)
-    hdr = _recv_exact(sock, 4)
-    (length,) = struct.unpack("<I", hdr)
-    _ = _recv_exact(sock, length)  # discard payload for speed
 
+# reply length header; a bound Struct skips the format-string lookup
+_U32 = struct.Struct("<I")
+
+
+def recv_reply(sock: socket.socket, mv: memoryview) -> None:
+    """
+    Read one length-prefixed response frame and discard it.
 
-def _recv_exact(sock: socket.socket, n: int) -> bytes:
-    data = bytearray()
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
+    The frame is received in place into the scratch buffer `mv` (recv_into),
+    in chunks of len(mv), so no bytes objects are allocated per reply.
+    """
+    recv_exact_into(sock, mv, 4)
+    (length,) = _U32.unpack_from(mv)
+    while length > 0:
+        n = min(length, len(mv))
+        recv_exact_into(sock, mv, n)
+        length -= n
+
+
+def recv_exact_into(sock: socket.socket, mv: memoryview, n: int) -> None:
+    got = 0
+    while got < n:
+        r = sock.recv_into(mv[got:n])
+        if not r:
             raise ConnectionError("socket closed during recv")
-        data.extend(chunk)
-    return bytes(data)
+        got += r
+
+
+# ---- connection setup -------------------------------------------------------
+
+DEFAULT_SOCK_BUF = 4 * 1024 * 1024
+
+def open_conn(host: str, port: int, nodelay: bool = True,
+              sndbuf: int = DEFAULT_SOCK_BUF,
+              rcvbuf: int = DEFAULT_SOCK_BUF) -> socket.socket:
+    """Connect and apply client socket options (0 buf size = kernel default)."""
+    sock = socket.create_connection((host, port))
+    set_sock_opts(sock, nodelay, sndbuf, rcvbuf)
+    return sock
+
+
+def set_sock_opts(sock: socket.socket, nodelay: bool = True,
+                  sndbuf: int = DEFAULT_SOCK_BUF,
+                  rcvbuf: int = DEFAULT_SOCK_BUF) -> None:
+    if nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if sndbuf > 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf > 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
 
 
 # ---- latency histogram ------------------------------------------------------
@@ -63,17 +174,91 @@ BUCKET_EDGES_US = [
     1000000,
 ]
 
-def build_hist(lat_us: List[int]) -> List[int]:
-    counts = [0]*(len(BUCKET_EDGES_US)+1)
-    for v in lat_us:
-        placed = False
-        for i, edge in enumerate(BUCKET_EDGES_US):
-            if v <= edge:
-                counts[i] += 1
-                placed = True
-                break
-        if not placed:
-            counts[-1] += 1
+# Running log-linear histogram (HDR-style): values below 2**HIST_SUB_BITS
+# get one bucket each; every higher power-of-two range is split into
+# 2**(HIST_SUB_BITS-1) equal sub-buckets, so a recorded value is kept to
+# within 1/1024 (~3 significant digits). Values >= 2**HIST_MAX_BITS us
+# (~19h) are clamped into the top bucket. _bench_inner uses the same layout.
+HIST_SUB_BITS = 11
+HIST_MAX_BITS = 36
+HIST_LEN = (HIST_MAX_BITS - HIST_SUB_BITS + 2) << (HIST_SUB_BITS - 1)
+
+
+def hist_index(v: int) -> int:
+    if v < (1 << HIST_SUB_BITS):
+        return v
+    if v >= (1 << HIST_MAX_BITS):
+        v = (1 << HIST_MAX_BITS) - 1
+    shift = v.bit_length() - HIST_SUB_BITS
+    return (shift << (HIST_SUB_BITS - 1)) + (v >> shift)
+
+
+def hist_upper(i: int) -> int:
+    """Largest value that maps to bucket i."""
+    if i < (1 << HIST_SUB_BITS):
+        return i
+    shift = (i >> (HIST_SUB_BITS - 1)) - 1
+    sub = i - (shift << (HIST_SUB_BITS - 1))
+    return ((sub + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Fixed-size latency recorder; O(buckets) memory however many samples."""
+
+    def __init__(self):
+        self.counts = array.array("Q", [0]) * HIST_LEN
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, v: int) -> None:
+        self.counts[hist_index(v)] += 1
+        self.n += 1
+        self.total += v
+        if v > self.max:
+            self.max = v
+
+    def add(self, other: "LatencyHistogram") -> None:
+        self.counts = array.array("Q", map(operator.add, self.counts, other.counts))
+        self.n += other.n
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self) -> float:
+        return self.total / self.n if self.n else 0.0
+
+    def percentiles(self, pcts: List[float]) -> List[int]:
+        """
+        Nearest-rank percentiles (pct in 0..100), to bucket resolution.
+
+        The p-th percentile is the ceil(p/100 * n)-th smallest sample,
+        clamped to 1..n, so p100 is the max and small runs never index
+        past the end.
+        """
+        if not self.n:
+            return [0] * len(pcts)
+        cum = list(itertools.accumulate(self.counts))
+        out = []
+        for pct in pcts:
+            # round() drops float noise such as 99.9/100*1000 == 999.0000000000001
+            rank = min(max(math.ceil(round(pct / 100.0 * self.n, 9)), 1), self.n)
+            out.append(min(hist_upper(bisect.bisect_left(cum, rank)), self.max))
+        return out
+
+    def count_le(self, edges: List[int]) -> List[int]:
+        """Samples at or below each edge, to bucket resolution."""
+        cum = list(itertools.accumulate(self.counts))
+        return [cum[hist_index(e)] for e in edges]
+
+
+def build_hist(hist: LatencyHistogram) -> List[int]:
+    """Counts per BUCKET_EDGES_US display bucket (v <= edge), plus overflow."""
+    counts = []
+    prev = 0
+    for le in hist.count_le(BUCKET_EDGES_US):
+        counts.append(le - prev)
+        prev = le
+    counts.append(hist.n - prev)
     return counts
 
 def format_hist(counts: List[int], total: int) -> str:
@@ -95,10 +280,21 @@ def format_hist(counts: List[int], total: int) -> str:
 
 # ---- worker -----------------------------------------------------------------
 
-class Worker(threading.Thread):
+class Worker(multiprocessing.Process):
+    """
+    One benchmark client driving `conns` connections (usually one).
+
+    Runs in a separate process so the encode/record path of each worker has
+    its own interpreter (and GIL). Results are sent back over `results` as
+    (wid, ops_done, errors, hist, t_start, t_end) and applied to the
+    parent's copy with collect().
+    """
+
     def __init__(self, wid: int, host: str, port: int, n_ops: int,
                  keyspace: int, p_get: float, p_set: float, p_del: float,
-                 value_len: int, record_latencies: bool):
+                 value_len: int, record_latencies: bool, pipeline: int = 1,
+                 sock_opts: Optional[dict] = None, results=None, start_gate=None,
+                 inflight: int = 1, use_ext: bool = True, conns: int = 1):
         super().__init__()
         self.wid = wid
         self.host = host
@@ -110,54 +306,266 @@ class Worker(threading.Thread):
         self.p_del = p_del
         self.value_len = value_len
         self.record_latencies = record_latencies
-        self.lat_us: List[int] = []
+        self.pipeline = max(1, pipeline)
+        self.inflight = max(1, inflight)
+        self.conns = max(1, conns)
+        self.use_ext = (use_ext and HAVE_INNER
+                        and self.inflight == 1 and self.conns == 1)
+        self.sock_opts = sock_opts or {}
+        self.results = results
+        self.start_gate = start_gate
+        self.hist = LatencyHistogram()
         self.errors = 0
         self.ops_done = 0
+        self.t_start = 0.0
+        self.t_end = 0.0
 
     def run(self):
         try:
-            sock = socket.create_connection((self.host, self.port))
+            self._run()
+        finally:
+            self.t_end = time.perf_counter()
+            if self.results is not None:
+                self.results.put((self.wid, self.ops_done, self.errors,
+                                  self.hist,
+                                  self.t_start, self.t_end))
+
+    def collect(self, result: tuple) -> None:
+        """Apply a result tuple reported by the child process."""
+        _, self.ops_done, self.errors, self.hist, self.t_start, self.t_end = result
+
+    def _run(self):
+        # encoded before t_start so the timed run does no per-op encoding
+        tables = None if self.use_ext else build_packet_tables(self.keyspace, "x"*self.value_len)
+        rnd = random.Random(self.wid ^ int(time.time()*1e6))
+        # the whole op stream is resolved to packets up front as well
+        stream = None if self.use_ext else self._draw_stream(rnd, tables)
+        if not gate_wait(self):  # line up with the other workers
+            return
+        self.t_start = time.perf_counter()
+
+        if self.use_ext:
+            self._run_ext(rnd)
+        elif self.inflight > 1 or self.conns > 1:
+            asyncio.run(self._run_async(stream))
+        else:
+            self._run_blocking(stream)
+
+    def _draw_stream(self, rnd: random.Random, tables) -> List[bytes]:
+        """
+        Packet for each of the n_ops ops, in send order.
+
+        The op is picked by locating a uniform draw among the cumulative
+        edges (p_get, p_get+p_set) -> 0=get, 1=set, 2=del, then combined
+        with a uniform key index in a single table lookup.
+        """
+        cum = (self.p_get, self.p_get + self.p_set)
+        rand, randrange, keyspace = rnd.random, rnd.randrange, self.keyspace
+        pick = bisect.bisect_right
+        return [tables[pick(cum, rand())][randrange(keyspace)]
+                for _ in range(self.n_ops)]
+
+    def _record(self, t0: int, t1: int) -> None:
+        if self.record_latencies:
+            self.hist.record((t1 - t0)//1000)
+        self.ops_done += 1
+
+    def _run_blocking(self, stream: List[bytes]):
+        try:
+            sock = open_conn(self.host, self.port, **self.sock_opts)
         except Exception as e:
             print(f"[worker {self.wid}] connect failed: {e}")
             self.errors = self.n_ops
             return
 
-        rnd = random.Random(self.wid ^ int(time.time()*1e6))
-        v_payload = "x"*self.value_len
-
-        for _ in range(self.n_ops):
-            op = self._pick_op(rnd.random())
-            key = f"k{rnd.randrange(self.keyspace)}"
-
-            if op == "get":
-                parts = ["get", key]
-            elif op == "set":
-                parts = ["set", key, v_payload]
-            else:  # del
-                parts = ["del", key]
-
+        # Ops are sent in batches of `pipeline` packets with a single
+        # sendall() (sendmsg() when pipelining large values), a batch being
+        # cut short at BURST_BYTES so the socket buffers never fill up; each
+        # op's latency runs from the batch send to its own response.
+        gather = (HAVE_SENDMSG and self.pipeline > 1
+                  and self.value_len >= GATHER_MIN)
+        rx = memoryview(bytearray(RX_BUF))  # reused for every reply
+        for pkts in split_bursts(stream, self.pipeline):
             t0 = time.perf_counter_ns()
             try:
-                send_and_wait(sock, parts)
+                send_packets(sock, pkts, gather)
+                for _ in pkts:
+                    recv_reply(sock, rx)
+                    self._record(t0, time.perf_counter_ns())
             except Exception:
                 self.errors += 1
                 break
-            t1 = time.perf_counter_ns()
 
-            if self.record_latencies:
-                self.lat_us.append((t1 - t0)//1000)
+        sock.close()
 
-            self.ops_done += 1
+    def _run_ext(self, rnd: random.Random):
+        """Blocking loop driven by the compiled _bench_inner.run_loop."""
+        try:
+            sock = open_conn(self.host, self.port, **self.sock_opts)
+        except Exception as e:
+            print(f"[worker {self.wid}] connect failed: {e}")
+            self.errors = self.n_ops
+            return
 
+        done, lat_total, lat_max = run_loop(
+            sock.fileno(), self.n_ops, rnd.getrandbits(64),
+            self.keyspace, self.p_get, self.p_set,
+            b"x"*self.value_len, self.pipeline,
+            self.hist.counts if self.record_latencies else None)
+        self.ops_done = done
+        if self.record_latencies:
+            self.hist.n, self.hist.total, self.hist.max = done, lat_total, lat_max
+        if done < self.n_ops:
+            self.errors += 1
         sock.close()
 
-    def _pick_op(self, r: float) -> str:
-        if r < self.p_get:
-            return "get"
-        r -= self.p_get
-        if r < self.p_set:
-            return "set"
-        return "del"
+    async def _run_async(self, stream: List[bytes]):
+        """
+        asyncio client: `conns` connections pull work from one shared
+        iterator, either single ops streamed `inflight` deep or, with
+        inflight == 1, `pipeline` batches (see _conn_actor).
+        """
+        if self.inflight > 1:
+            ops = iter(stream)
+        else:
+            ops = split_bursts(stream, self.pipeline)
+        connected = await asyncio.gather(
+            *(self._conn_actor(ops) for _ in range(self.conns)))
+        if not any(connected):
+            self.errors = self.n_ops
+
+    async def _conn_actor(self, ops) -> bool:
+        """
+        One connection streaming ops from `ops` (see _stream_conn), or
+        sending the batches from `ops` when inflight == 1 (_batch_conn).
+        Returns False if the connection could not be opened.
+        """
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except Exception as e:
+            print(f"[worker {self.wid}] connect failed: {e}")
+            return False
+        set_sock_opts(writer.get_extra_info("socket"), **self.sock_opts)
+
+        try:
+            if self.inflight > 1:
+                await self._stream_conn(reader, writer, ops)
+            else:
+                await self._batch_conn(reader, writer, ops)
+        except Exception:
+            self.errors += 1
+        finally:
+            writer.close()
+        return True
+
+    async def _batch_conn(self, reader, writer, bursts) -> None:
+        """
+        The asyncio form of _run_blocking: write the next batch from
+        `bursts`, then read its replies; latency runs from the batch send
+        to each reply.
+        """
+        for pkts in bursts:
+            t0 = time.perf_counter_ns()
+            writer.write(b"".join(pkts))
+            await writer.drain()
+            for _ in pkts:
+                hdr = await reader.readexactly(4)
+                (length,) = _U32.unpack(hdr)
+                await reader.readexactly(length)
+                self._record(t0, time.perf_counter_ns())
+
+    async def _stream_conn(self, reader, writer, ops) -> None:
+        """
+        A sender task takes the next op from `ops` whenever the `inflight`
+        window has room while this coroutine reads replies. The server
+        answers in order, so send timestamps are matched to replies FIFO.
+        A failed read or write is raised to the caller.
+        """
+        window = asyncio.Semaphore(self.inflight)
+        sent_ns: asyncio.Queue = asyncio.Queue()
+
+        async def sender():
+            try:
+                while True:
+                    await window.acquire()
+                    pkt = next(ops, None)
+                    if pkt is None:
+                        break
+                    sent_ns.put_nowait(time.perf_counter_ns())
+                    writer.write(pkt)
+                    await writer.drain()
+            finally:
+                sent_ns.put_nowait(None)  # no more replies to wait for
+
+        send_task = asyncio.ensure_future(sender())
+        try:
+            while (t0 := await sent_ns.get()) is not None:
+                hdr = await reader.readexactly(4)
+                (length,) = _U32.unpack(hdr)
+                await reader.readexactly(length)
+                self._record(t0, time.perf_counter_ns())
+                window.release()
+        finally:
+            send_task.cancel()  # no-op once it has finished
+            # retrieve its outcome, so a failed write is counted rather
+            # than logged as "Task exception was never retrieved"
+            (sent,) = await asyncio.gather(send_task, return_exceptions=True)
+        if isinstance(sent, Exception):
+            raise sent
+
+
+# ---- process coordination ---------------------------------------------------
+
+# Longest a worker waits at the start gate for the others; a backstop, as
+# collect_results() breaks the gate as soon as a worker dies unreported.
+GATE_TIMEOUT = 300.0
+RESULT_POLL = 0.5  # s between liveness checks while waiting for results
+
+
+def gate_wait(w) -> bool:
+    """
+    Wait at w.start_gate (if any). If the gate is broken or times out the
+    worker gives up before connecting: returns False with all of its ops
+    counted as errors.
+    """
+    if w.start_gate is None:
+        return True
+    try:
+        w.start_gate.wait()
+    except threading.BrokenBarrierError:
+        print(f"[worker {w.wid}] start gate broken; not running")
+        w.errors = w.n_ops
+        return False
+    return True
+
+
+def collect_results(workers: list, results, start_gate=None) -> None:
+    """
+    Apply each worker's result tuple (wid first) from `results` with
+    collect(), without hanging on workers that die unreported.
+
+    A worker that exits without reporting (killed, crashed in the compiled
+    loop, os._exit) gets errors = n_ops, and the start gate is aborted so
+    workers still waiting there give up instead of waiting for it.
+    """
+    pending = {w.wid: w for w in workers}
+    exited = set()
+    while pending:
+        try:
+            result = results.get(timeout=RESULT_POLL)
+        except queue.Empty:
+            # a child's queued result is flushed to the pipe before it exits,
+            # so one that had exited by the last poll and still has not
+            # reported never will
+            for wid in exited & pending.keys():
+                w = pending.pop(wid)
+                print(f"[worker {wid}] exited (code {w.exitcode}) without reporting")
+                w.errors = w.n_ops
+                if start_gate is not None:
+                    start_gate.abort()
+            exited = {wid for wid, w in pending.items() if w.exitcode is not None}
+            continue
+        pending.pop(result[0]).collect(result)
 
 
 # ---- benchmark driver -------------------------------------------------------
@@ -168,11 +576,32 @@ def run_bench(host: str, port: int,
               read_ratio: float, write_ratio: float, del_ratio: float,
               value_len: int,
               warmup_ops: int,
-              lat_every: int) -> None:
+              lat_every: int,
+              pipeline: int = 1,
+              sock_opts: Optional[dict] = None,
+              inflight: int = 1,
+              use_ext: bool = True,
+              connections: Optional[int] = None) -> None:
     """
     lat_every:
       0 -> record all latencies
       N -> sample 1 op per N (approx) by controlling record flag per worker
+    pipeline:
+      number of commands each worker sends per batch (1 = one round-trip per op)
+    sock_opts:
+      keyword args for open_conn (nodelay / sndbuf / rcvbuf)
+    inflight:
+      >1 switches workers to an asyncio client keeping this many requests
+      outstanding per connection; it replaces pipeline (which must then be
+      1) and the compiled loop
+    use_ext:
+      run the blocking loop in the compiled _bench_inner extension if built
+      (one connection per worker and inflight == 1 only)
+    connections:
+      total connections, spread over the workers (default: one per worker);
+      fewer connections than threads also caps the number of workers, more
+      gives each worker several connections driven by asyncio, still
+      sending `pipeline` batches when inflight == 1
     """
     # Normalize ratios
     total_ratio = read_ratio + write_ratio + del_ratio
@@ -181,60 +610,98 @@ def run_bench(host: str, port: int,
     p_get = read_ratio / total_ratio
     p_set = write_ratio / total_ratio
     p_del = del_ratio / total_ratio
+    if inflight > 1 and pipeline > 1:
+        raise ValueError("inflight > 1 cannot be combined with pipeline > 1")
+    if threads < 1:
+        raise ValueError("threads must be >= 1")
+    if connections is None:
+        connections = threads
+    if connections < 1:
+        raise ValueError("connections must be >= 1")
 
     # Warmup (optional)
     if warmup_ops > 0:
-        _warmup(host, port, warmup_ops, keyspace, value_len)
+        _warmup(host, port, warmup_ops, keyspace, value_len, sock_opts)
 
+    threads = min(threads, connections)
     ops_per_thread = total_ops // threads
     leftover = total_ops % threads
+    conns_per_thread = connections // threads
+    conns_leftover = connections % threads
 
+    results = multiprocessing.Queue()
+    start_gate = multiprocessing.Barrier(threads, timeout=GATE_TIMEOUT)
     workers: List[Worker] = []
     for i in range(threads):
         n_ops = ops_per_thread + (1 if i < leftover else 0)
+        conns = conns_per_thread + (1 if i < conns_leftover else 0)
         # simple sampling: record latencies in all workers if lat_every ==0
         record_lat = (lat_every == 0) or (i % lat_every == 0)
         w = Worker(i, host, port, n_ops, keyspace,
-                   p_get, p_set, p_del, value_len, record_lat)
+                   p_get, p_set, p_del, value_len, record_lat, pipeline,
+                   sock_opts, results, start_gate, inflight, use_ext, conns)
         workers.append(w)
 
-    start = time.perf_counter()
     for w in workers:
         w.start()
+    # drain the queue before join() so children never block on a full pipe
+    collect_results(workers, results, start_gate)
     for w in workers:
         w.join()
-    end = time.perf_counter()
+
+    # perf_counter is a system-wide monotonic clock, so the children's
+    # timestamps are comparable; the run spans first start to last finish
+    # of the workers that got past the start gate.
+    ran = [w for w in workers if w.t_start]
+    start = min((w.t_start for w in ran), default=0.0)
+    end = max((w.t_end for w in ran), default=0.0)
 
     total_done = sum(w.ops_done for w in workers)
     total_errs = sum(w.errors for w in workers)
     dur = end - start
     tput = total_done / dur if dur > 0 else 0
 
-    lat_samples = [lat for w in workers for lat in w.lat_us]
-    _print_results(total_done, total_errs, dur, tput, lat_samples, workers)
+    hist = LatencyHistogram()
+    for w in workers:
+        hist.add(w.hist)
+    _print_results(total_done, total_errs, dur, tput, hist, workers)
 
 
-def _warmup(host: str, port: int, warmup_ops: int, keyspace: int, value_len: int):
+def _warmup(host: str, port: int, warmup_ops: int, keyspace: int, value_len: int,
+            sock_opts: Optional[dict] = None):
     """Do some SETs to populate DB, no timing."""
     print(f"[warmup] {warmup_ops} SET ops...")
     try:
-        sock = socket.create_connection((host, port))
+        sock = open_conn(host, port, **(sock_opts or {}))
     except Exception as e:
         print(f"[warmup] connect failed: {e}")
         return
     v_payload = "x"*value_len
     rnd = random.Random(12345)
-    for _ in range(warmup_ops):
-        key = f"w{rnd.randrange(keyspace)}"
-        try:
-            send_and_wait(sock, ["set", key, v_payload])
-        except Exception as e:
-            print(f"[warmup] error: {e}")
-            break
+    pkts = [pack_command(["set", f"w{rnd.randrange(keyspace)}", v_payload])
+            for _ in range(warmup_ops)]
+    try:
+        send_pipelined(sock, pkts)
+    except Exception as e:
+        print(f"[warmup] error: {e}")
     sock.close()
 
 
-def _print_results(total_done, total_errs, dur, tput, lat_samples, workers):
+def send_pipelined(sock: socket.socket, pkts: List[bytes],
+                   burst_bytes: int = BURST_BYTES) -> None:
+    """
+    Send all packets and read all replies, ~burst_bytes of requests per
+    sendall(). Draining each burst's replies before the next bounds what
+    is in flight, so neither side can stall on a full socket buffer.
+    """
+    rx = memoryview(bytearray(RX_BUF))
+    for burst in split_bursts(pkts, len(pkts), burst_bytes):
+        sock.sendall(b"".join(burst))
+        for _ in burst:
+            recv_reply(sock, rx)
+
+
+def _print_results(total_done, total_errs, dur, tput, hist, workers):
     print()
     print("===== Benchmark Results =====")
     print(f"Total ops attempted : {total_done + total_errs}")
@@ -247,19 +714,13 @@ def _print_results(total_done, total_errs, dur, tput, lat_samples, workers):
     # for w in workers:
     #     print(f"  thread {w.wid}: {w.ops_done} ops")
 
-    if not lat_samples:
+    if not hist.n:
         print("\n(no latency samples recorded)")
         return
 
-    lat_sorted = sorted(lat_samples)
-    n = len(lat_sorted)
-
-    avg = sum(lat_sorted)/n
-    p50 = lat_sorted[int(n*0.50)]
-    p95 = lat_sorted[int(n*0.95)]
-    p99 = lat_sorted[int(n*0.99)]
-    p999 = lat_sorted[int(n*0.999)] if n >= 1000 else lat_sorted[-1]
-    mx = lat_sorted[-1]
+    n = hist.n
+    avg = hist.mean()
+    p50, p95, p99, p999, mx = hist.percentiles([50, 95, 99, 99.9, 100])
 
     print("\nLatency (microseconds):")
     print(f"  avg   : {avg:,.1f} us  ({avg/1000:.3f} ms)")
@@ -269,7 +730,7 @@ def _print_results(total_done, total_errs, dur, tput, lat_samples, workers):
     print(f"  p99.9 : {p999:,} us    ({p999/1000:.3f} ms)")
     print(f"  max   : {mx:,} us      ({mx/1000:.3f} ms)")
 
-    counts = build_hist(lat_sorted)
+    counts = build_hist(hist)
     print("\nLatency Histogram:")
     print(format_hist(counts, n))
 
@@ -284,7 +745,7 @@ def parse_args():
     ap.add_argument("--port", type=int, default=1234, help="Server port")
 
     ap.add_argument("--ops", type=int, default=100000, help="Total operations")
-    ap.add_argument("--threads", type=int, default=10, help="Number of worker threads")
+    ap.add_argument("--threads", type=int, default=10, help="Number of worker processes")
     ap.add_argument("--keyspace", type=int, default=10000, help="Number of distinct keys")
 
     ap.add_argument("--read-ratio", type=float, default=0.5, help="Fraction of reads (GET)")
@@ -299,7 +760,47 @@ def parse_args():
         help="Record latency in every Nth worker (0=all workers)."
     )
 
-    return ap.parse_args()
+    ap.add_argument(
+        "--pipeline", type=int, default=1,
+        help="Commands sent per batch before reading replies (1=no pipelining); "
+             "must be 1 with --inflight > 1."
+    )
+
+    ap.add_argument(
+        "--inflight", type=int, default=1,
+        help="Max outstanding requests per connection, streamed via asyncio "
+             "(1=send --pipeline batches instead). Replaces the batches and "
+             "the compiled loop, so it needs --pipeline 1."
+    )
+    ap.add_argument(
+        "--connections", type=int, default=None,
+        help="Total client connections (>= 1), spread over the workers "
+             "(default: --threads). Fewer than --threads also caps the "
+             "number of worker processes at this value; more gives each "
+             "worker several connections driven by asyncio (still sending "
+             "--pipeline batches, but without the compiled loop)."
+    )
+    ap.add_argument(
+        "--no-ext", action="store_true",
+        help="Use the pure-Python worker loop even if _bench_inner is built."
+    )
+    ap.add_argument(
+        "--nodelay", action=argparse.BooleanOptionalAction, default=True,
+        help="Set TCP_NODELAY on client sockets (disable Nagle)."
+    )
+    ap.add_argument("--sndbuf", type=int, default=DEFAULT_SOCK_BUF,
+                    help="Client SO_SNDBUF in bytes (0=kernel default)")
+    ap.add_argument("--rcvbuf", type=int, default=DEFAULT_SOCK_BUF,
+                    help="Client SO_RCVBUF in bytes (0=kernel default)")
+
+    args = ap.parse_args()
+    if args.threads < 1:
+        ap.error("--threads must be >= 1")
+    if args.inflight > 1 and args.pipeline > 1:
+        ap.error("--inflight > 1 streams requests; use it with --pipeline 1")
+    if args.connections is not None and args.connections < 1:
+        ap.error("--connections must be >= 1")
+    return args
 
 
 # ---- main -------------------------------------------------------------------
@@ -318,6 +819,11 @@ def main():
         value_len=args.value_len,
         warmup_ops=args.warmup_ops,
         lat_every=args.lat_every,
+        pipeline=args.pipeline,
+        inflight=args.inflight,
+        connections=args.connections,
+        use_ext=not args.no_ext,
+        sock_opts=dict(nodelay=args.nodelay, sndbuf=args.sndbuf, rcvbuf=args.rcvbuf),
     )
 
 if __name__ == "__main__":
@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 import argparse
+import bisect
 import time
 import random
 import socket
-import threading
-import statistics
+import multiprocessing
 import json
-import csv
+import itertools
 import struct
 import sys
-from typing import List
+from typing import List, Optional
+
+# Packet tables, socket I/O and the latency histogram are shared with bench.py
+from bench import (DEFAULT_SOCK_BUF, GATE_TIMEOUT, GATHER_MIN, HAVE_SENDMSG,
+                   RX_BUF, LatencyHistogram, build_packet_tables,
+                   collect_results, gate_wait, recv_reply, send_packets,
+                   send_pipelined, set_sock_opts, split_bursts)
 
 # -----------------------------
 # Optional Matplotlib import
@@ -33,61 +39,61 @@ def build_packet(parts: List[str]) -> bytes:
         repeat: [4-byte strlen][bytes]
     Little-endian (<).
     """
-    body = struct.pack("<I", len(parts))
+    chunks = [b"", struct.pack("<I", len(parts))]  # [0] = total_len slot
+    size = 4
     for p in parts:
         b = p.encode()
-        body += struct.pack("<I", len(b)) + b
-    return struct.pack("<I", len(body)) + body
-
-
-def recv_exact(sock: socket.socket, n: int) -> bytes:
-    """Read exactly n bytes."""
-    data = bytearray()
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
-            raise ConnectionError("socket closed during recv_exact")
-        data.extend(chunk)
-    return bytes(data)
+        chunks.append(struct.pack("<I", len(b)))
+        chunks.append(b)
+        size += 4 + len(b)
+    chunks[0] = struct.pack("<I", size)
+    return b"".join(chunks)
 
 
-def send_cmd(sock: socket.socket, *parts: str) -> None:
-    """Send one command; read & discard server response."""
-    pkt = build_packet(list(parts))
-    sock.sendall(pkt)
-    hdr = recv_exact(sock, 4)
-    (plen,) = struct.unpack("<I", hdr)
-    _ = recv_exact(sock, plen)  # discard payload
+def connect(host: str, port: int, timeout: Optional[float] = None,
+            **sock_opts) -> socket.socket:
+    """bench.open_conn plus a connect/IO timeout; sock_opts go to set_sock_opts."""
+    s = socket.create_connection((host, port), timeout=timeout)
+    set_sock_opts(s, **sock_opts)
+    return s
 
 
 # ============================================================
 # Warm-up
 # ============================================================
 
-def warmup(host: str, port: int, n: int = 1000, value: str = "hello") -> None:
+def warmup(host: str, port: int, n: int = 1000, value: str = "hello",
+           sock_opts: Optional[dict] = None) -> None:
     """Populate server so benchmark doesn't start cold."""
     print(f"[warmup] {n} SET ops...")
     try:
-        s = socket.create_connection((host, port), timeout=5)
+        s = connect(host, port, timeout=5, **(sock_opts or {}))
     except Exception as e:
         print(f"[warmup] connect failed ({host}:{port}): {e}")
         return
     try:
-        for i in range(n):
-            send_cmd(s, "set", f"warm{i}", value)
+        send_pipelined(s, [build_packet(["set", f"warm{i}", value]) for i in range(n)])
     finally:
         s.close()
 
 
 # ============================================================
-# Worker thread
+# Worker process
 # ============================================================
 
-class Worker(threading.Thread):
+class Worker(multiprocessing.Process):
+    """
+    Benchmark client running in its own process (own GIL).
+    Reports (wid, hist, latencies, errors, t_start, t_end) on `results`;
+    the parent applies it with collect(). Raw per-op latencies are only
+    kept when keep_samples is set (CSV export / plots).
+    """
+
     def __init__(self, wid: int, host: str, port: int, n_ops: int,
                  keyspace: int, p_get: float, p_set: float, p_del: float,
-                 value_len: int, latencies: List[float], lock: threading.Lock,
-                 errors_ref: List[int]):
+                 value_len: int, pipeline: int = 1,
+                 sock_opts: Optional[dict] = None, results=None, start_gate=None,
+                 keep_samples: bool = False):
         super().__init__()
         self.wid = wid
         self.host = host
@@ -98,45 +104,71 @@ class Worker(threading.Thread):
         self.p_set = p_set
         self.p_del = p_del
         self.value_len = value_len
-        self.latencies = latencies
-        self.lock = lock
-        self.errors_ref = errors_ref  # single-element list used as mutable int
+        self.hist = LatencyHistogram()
+        self.keep_samples = keep_samples
+        self.latencies: List[float] = []  # per-worker; merged after join()
+        self.errors: int = 0
+        self.pipeline = max(1, pipeline)
+        self.sock_opts = sock_opts or {}
+        self.results = results
+        self.start_gate = start_gate
+        self.t_start = 0.0
+        self.t_end = 0.0
 
     def run(self):
         try:
-            s = socket.create_connection((self.host, self.port))
+            self._run()
+        finally:
+            self.t_end = time.perf_counter()
+            if self.results is not None:
+                self.results.put((self.wid, self.hist, self.latencies, self.errors,
+                                  self.t_start, self.t_end))
+
+    def collect(self, result: tuple) -> None:
+        _, self.hist, self.latencies, self.errors, self.t_start, self.t_end = result
+
+    def _run(self):
+        # pre-encoded outside the timed region
+        tables = build_packet_tables(self.keyspace, "x" * self.value_len)
+        # ...and so is the op stream: each draw picks its op by position among
+        # the cumulative edges (0=get, 1=set, 2=del), resolved with the key
+        # index to a packet, so the timed loop makes no RNG calls or branches
+        rnd = random.Random(self.wid ^ int(time.time() * 1e6))
+        cum = (self.p_get, self.p_get + self.p_set)
+        stream = [tables[bisect.bisect_right(cum, rnd.random())][rnd.randrange(self.keyspace)]
+                  for _ in range(self.n_ops)]
+        if not gate_wait(self):
+            return
+        self.t_start = time.perf_counter()
+
+        try:
+            s = connect(self.host, self.port, **self.sock_opts)
         except Exception as e:
-            with self.lock:
-                self.errors_ref[0] += self.n_ops
+            self.errors += self.n_ops
             print(f"[worker {self.wid}] connect failed: {e}")
             return
 
-        rnd = random.Random(self.wid ^ int(time.time() * 1e6))
-        value = "x" * self.value_len
-
-        for _ in range(self.n_ops):
-            r = rnd.random()
-            if r < self.p_get:
-                parts = ("get", f"k{rnd.randrange(self.keyspace)}")
-            else:
-                r -= self.p_get
-                if r < self.p_set:
-                    parts = ("set", f"k{rnd.randrange(self.keyspace)}", value)
-                else:
-                    parts = ("del", f"k{rnd.randrange(self.keyspace)}")
-
+        # Send `pipeline` commands per sendall() (gathered with sendmsg()
+        # when pipelining large values), cut short at BURST_BYTES so the
+        # socket buffers never fill up, then read the replies in order;
+        # latency is measured from batch send to each reply.
+        gather = (HAVE_SENDMSG and self.pipeline > 1
+                  and self.value_len >= GATHER_MIN)
+        rx = memoryview(bytearray(RX_BUF))  # scratch reused for every reply
+        for pkts in split_bursts(stream, self.pipeline):
             t0 = time.perf_counter_ns()
             try:
-                send_cmd(s, *parts)
+                send_packets(s, pkts, gather)
+                for _ in pkts:
+                    recv_reply(s, rx)
+                    t1 = time.perf_counter_ns()
+                    lat_us = (t1 - t0) // 1000
+                    self.hist.record(lat_us)
+                    if self.keep_samples:
+                        self.latencies.append(lat_us)
             except Exception:
-                with self.lock:
-                    self.errors_ref[0] += 1
+                self.errors += 1
                 break
-            t1 = time.perf_counter_ns()
-
-            lat_us = (t1 - t0) // 1000
-            with self.lock:
-                self.latencies.append(lat_us)
 
         s.close()
 
@@ -145,19 +177,13 @@ class Worker(threading.Thread):
 # Results / stats helpers
 # ============================================================
 
-def pct_lat(lat_sorted: List[float], pct: float) -> float:
-    if not lat_sorted:
-        return 0.0
-    idx = min(int(len(lat_sorted) * pct), len(lat_sorted) - 1)
-    return lat_sorted[idx]
-
-
 def write_csv(path: str, lat_sorted: List[float]) -> None:
+    # Format every row in one pass and write once; same bytes as csv.writer
+    # (\r\n terminators) without a Python-level writerow() per sample.
+    rows = "".join([f"{i},{v:.2f}\r\n" for i, v in enumerate(lat_sorted, 1)])
     with open(path, "w", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["op", "latency_us"])
-        for i, v in enumerate(lat_sorted, 1):
-            w.writerow([i, f"{v:.2f}"])
+        f.write("op,latency_us\r\n")
+        f.write(rows)
     print(f"✅ Latency data exported to {path}")
 
 
@@ -211,7 +237,7 @@ def plot_latency(lat_sorted: List[float]) -> None:
 def main():
     parser = argparse.ArgumentParser(description="Benchmark custom Redis-like server.")
     parser.add_argument("--ops", type=int, default=100000, help="Total operations.")
-    parser.add_argument("--threads", type=int, default=10, help="Worker threads.")
+    parser.add_argument("--threads", type=int, default=10, help="Worker processes.")
     parser.add_argument("--host", type=str, default="127.0.0.1", help="Server host.")
     parser.add_argument("--port", type=int, default=1234, help="Server port (default 1234).")
     parser.add_argument("--value-len", type=int, default=16, help="Value length for SET.")
@@ -219,6 +245,11 @@ def main():
     parser.add_argument("--read-ratio", type=float, default=0.5, help="GET percentage.")
     parser.add_argument("--write-ratio", type=float, default=0.4, help="SET percentage.")
     parser.add_argument("--del-ratio", type=float, default=0.1, help="DEL percentage.")
+    parser.add_argument("--pipeline", type=int, default=1, help="Commands per batch (1 = no pipelining).")
+    parser.add_argument("--nodelay", action=argparse.BooleanOptionalAction, default=True,
+                        help="Set TCP_NODELAY on client sockets.")
+    parser.add_argument("--sndbuf", type=int, default=DEFAULT_SOCK_BUF, help="SO_SNDBUF bytes (0 = OS default).")
+    parser.add_argument("--rcvbuf", type=int, default=DEFAULT_SOCK_BUF, help="SO_RCVBUF bytes (0 = OS default).")
     parser.add_argument("--no-warmup", action="store_true", help="Skip warm-up phase.")
     parser.add_argument("--warmup-ops", type=int, default=1000, help="# warm-up SET ops.")
     parser.add_argument("--export", type=str, help="Export per-op latencies to CSV.")
@@ -235,18 +266,18 @@ def main():
     p_set = args.write_ratio / total_ratio
     p_del = args.del_ratio / total_ratio
 
+    sock_opts = dict(nodelay=args.nodelay, sndbuf=args.sndbuf, rcvbuf=args.rcvbuf)
+
     # Warm-up
     if not args.no_warmup:
-        warmup(args.host, args.port, n=args.warmup_ops, value="warmval")
+        warmup(args.host, args.port, n=args.warmup_ops, value="warmval", sock_opts=sock_opts)
 
     # Work distribution
     ops_per_thread = args.ops // args.threads
     leftover = args.ops % args.threads
 
-    latencies: List[float] = []
-    lock = threading.Lock()
-    errors_ref = [0]  # boxed int
-
+    results = multiprocessing.Queue()
+    start_gate = multiprocessing.Barrier(args.threads, timeout=GATE_TIMEOUT)
     workers = []
     for i in range(args.threads):
         n_ops = ops_per_thread + (1 if i < leftover else 0)
@@ -260,24 +291,32 @@ def main():
             p_set=p_set,
             p_del=p_del,
             value_len=args.value_len,
-            latencies=latencies,
-            lock=lock,
-            errors_ref=errors_ref,
+            pipeline=args.pipeline,
+            sock_opts=sock_opts,
+            results=results,
+            start_gate=start_gate,
+            keep_samples=bool(args.export or args.plot),
         )
         workers.append(w)
 
     # Run benchmark
     print("\n===== Benchmark Running =====")
-    t0 = time.perf_counter()
     for w in workers:
         w.start()
+    # drain results before join() so no child blocks on a full queue pipe
+    collect_results(workers, results, start_gate)
     for w in workers:
         w.join()
-    t1 = time.perf_counter()
 
-    dur = t1 - t0
-    total_done = len(latencies)
-    total_errs = errors_ref[0]
+    # perf_counter is system-wide monotonic: span = first start .. last
+    # finish of the workers that got past the start gate
+    ran = [w for w in workers if w.t_start]
+    dur = (max(w.t_end for w in ran) - min(w.t_start for w in ran)) if ran else 0.0
+    hist = LatencyHistogram()
+    for w in workers:
+        hist.add(w.hist)
+    total_done = hist.n
+    total_errs = sum(w.errors for w in workers)
     tput = total_done / dur if dur > 0 else 0.0
 
     # Stats
@@ -285,13 +324,14 @@ def main():
         print("No successful operations recorded.")
         return 1
 
-    lat_sorted = sorted(latencies)
-    avg = statistics.mean(lat_sorted)
-    p50 = pct_lat(lat_sorted, 0.50)
-    p95 = pct_lat(lat_sorted, 0.95)
-    p99 = pct_lat(lat_sorted, 0.99)
-    p999 = pct_lat(lat_sorted, 0.999)
-    max_lat = lat_sorted[-1]
+    avg = hist.mean()
+    p50, p95, p99, p999 = hist.percentiles([50, 95, 99, 99.9])
+    max_lat = hist.max
+
+    # per-op samples are only collected (and sorted) for export/plots
+    lat_sorted: List[float] = []
+    if args.export or args.plot:
+        lat_sorted = sorted(itertools.chain.from_iterable(w.latencies for w in workers))
 
     print("\n===== Benchmark Results =====")
     print(f"Total ops attempted : {args.ops}")
@@ -315,6 +355,7 @@ def main():
         summary = {
             "ops": args.ops,
             "threads": args.threads,
+            "pipeline": args.pipeline,
             "host": args.host,
             "port": args.port,
             "keyspace": args.keyspace,
@@ -5,13 +5,18 @@ import time
 
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 1234
+_U32 = struct.Struct('<I')
 
 def build_request(args):
-    buf = struct.pack('<I', len(args))
+    chunks = [b'', struct.pack('<I', len(args))]
+    size = 4
     for arg in args:
         arg_bytes = arg.encode()
-        buf += struct.pack('<I', len(arg_bytes)) + arg_bytes
-    return struct.pack('<I', len(buf)) + buf
+        chunks.append(struct.pack('<I', len(arg_bytes)))
+        chunks.append(arg_bytes)
+        size += 4 + len(arg_bytes)
+    chunks[0] = struct.pack('<I', size)
+    return b''.join(chunks)
 
 def send_request(sock, args):
     req = build_request(args)
@@ -19,7 +24,7 @@ def send_request(sock, args):
     header = sock.recv(4)
     if not header:
         return None
-    length = struct.unpack('<I', header)[0]
+    (length,) = _U32.unpack(header)
     return sock.recv(length)
 
 def worker(n_ops):
@@ -16,6 +16,12 @@ TAG_INT = 3
 TAG_DBL = 4
 TAG_ARR = 5
 
+# precompiled decoders for the fixed-width fields
+_U32 = struct.Struct("<I").unpack_from
+_U32x2 = struct.Struct("<II").unpack_from
+_I64 = struct.Struct("<q").unpack_from
+_F64 = struct.Struct("<d").unpack_from
+
 def pack_command(parts: List[str]) -> bytes:
     """
     Build a request packet:
@@ -44,58 +50,69 @@ def decode_value(buf: bytes, off: int = 0) -> Tuple[Any, int]:
     """
     Decode one value starting at buf[off].
     Returns (value, new_offset).
+
+    Arrays are filled from an explicit stack of (list, items left) rather
+    than by recursion, so nesting depth is not bounded by the call stack.
     """
-    _need(buf, off, 1)
-    tag = buf[off]
-    off += 1
-
-    if tag == TAG_NIL:
-        return None, off
-
-    if tag == TAG_ERR:
-        _need(buf, off, 4)
-        code = struct.unpack_from("<I", buf, off)[0]
-        off += 4
-        _need(buf, off, 4)
-        mlen = struct.unpack_from("<I", buf, off)[0]
-        off += 4
-        _need(buf, off, mlen)
-        msg = buf[off:off+mlen].decode("utf-8", errors="replace")
-        off += mlen
-        return RuntimeError(f"[{code}] {msg}"), off
-
-    if tag == TAG_STR:
-        _need(buf, off, 4)
-        slen = struct.unpack_from("<I", buf, off)[0]
-        off += 4
-        _need(buf, off, slen)
-        s = buf[off:off+slen].decode("utf-8", errors="replace")
-        off += slen
-        return s, off
-
-    if tag == TAG_INT:
-        _need(buf, off, 8)
-        val = struct.unpack_from("<q", buf, off)[0]
-        off += 8
-        return val, off
-
-    if tag == TAG_DBL:
-        _need(buf, off, 8)
-        val = struct.unpack_from("<d", buf, off)[0]
-        off += 8
-        return val, off
-
-    if tag == TAG_ARR:
-        _need(buf, off, 4)
-        count = struct.unpack_from("<I", buf, off)[0]
-        off += 4
-        arr = []
-        for _ in range(count):
-            v, off = decode_value(buf, off)
-            arr.append(v)
-        return arr, off
-
-    raise ValueError(f"Unknown tag: {tag}")
+    stack: List[Tuple[list, int]] = []
+    while True:
+        _need(buf, off, 1)
+        tag = buf[off]
+        off += 1
+
+        if tag == TAG_NIL:
+            val = None
+
+        elif tag == TAG_ERR:
+            _need(buf, off, 8)
+            code, mlen = _U32x2(buf, off)
+            off += 8
+            _need(buf, off, mlen)
+            msg = buf[off:off+mlen].decode("utf-8", errors="replace")
+            off += mlen
+            val = RuntimeError(f"[{code}] {msg}")
+
+        elif tag == TAG_STR:
+            _need(buf, off, 4)
+            slen = _U32(buf, off)[0]
+            off += 4
+            _need(buf, off, slen)
+            val = buf[off:off+slen].decode("utf-8", errors="replace")
+            off += slen
+
+        elif tag == TAG_INT:
+            _need(buf, off, 8)
+            val = _I64(buf, off)[0]
+            off += 8
+
+        elif tag == TAG_DBL:
+            _need(buf, off, 8)
+            val = _F64(buf, off)[0]
+            off += 8
+
+        elif tag == TAG_ARR:
+            _need(buf, off, 4)
+            count = _U32(buf, off)[0]
+            off += 4
+            if count:
+                stack.append(([], count))
+                continue  # decode its first element next
+            val = []
+
+        else:
+            raise ValueError(f"Unknown tag: {tag}")
+
+        # hand the value to its enclosing array(s), closing any that fill up
+        while stack:
+            arr, left = stack[-1]
+            arr.append(val)
+            if left > 1:
+                stack[-1] = (arr, left - 1)
+                break
+            stack.pop()
+            val = arr
+        else:
+            return val, off
 
 
 def decode_response(payload: bytes) -> Any: